@@ -1,136 +1,291 @@
 import os
-from flask import Flask, render_template, request
-from collections import defaultdict
-import math
+import sys
+import threading
+import time
+from flask import Flask, request, stream_template
+from concurrent.futures import ThreadPoolExecutor
 
 app = Flask(__name__)
 
 # Список корневых каталогов, которые можно задавать в приложении
 ROOT_DIRECTORIES = ['/data/DDAM1', '/data/DDAM2']
 
+# Индекс корневого каталога в ROOT_DIRECTORIES, по нему адресуются списки размеров
+ROOT_INDEX = {root: i for i, root in enumerate(ROOT_DIRECTORIES)}
+
+# Время жизни закэшированной статистики в секундах
+_CACHE_TTL = 30
+_CACHE = {'ts': 0.0, 'data': None}
+_CACHE_LOCK = threading.Lock()
+
+# Флаги открытия подкаталогов: только каталоги, без перехода по символическим ссылкам
+_DIR_FLAGS = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+
+def _walk_sdfa(dir_fd, parts=(), key=None, seen_inodes=None):
+    """Рекурсивно обходит открытый каталог SDS/data и возвращает суммарный размер файлов _sdfa
+    каждого каталога вместе с ключом (project, version, ident).
+
+    В seen_inodes складываются файлы с жёсткими ссылками: (key, st_dev, st_ino) -> размер"""
+    if seen_inodes is None:
+        seen_inodes = {}
+    depth = len(parts)  # Глубина относительно SDS/data
+    try:
+        # Как и os.fwalk, читаем каталог по дескриптору, без разбора полного пути
+        it = os.scandir(dir_fd)
+    except OSError:
+        return  # Молча пропускаем недоступные каталоги
+    subdirs = []
+    dir_size = 0
+    found = False
+    with it:
+        for entry in it:
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry)
+            elif key is not None and entry.name[-5:] == '_sdfa' and not entry.is_dir():
+                # Файлы учитываются только внутри project/version/ident. Как и в списке
+                # файлов os.walk, берём всё, кроме каталогов и ссылок на каталоги
+                try:
+                    # Размер берём из DirEntry через fstatat относительно dir_fd.
+                    # Как и os.path.getsize, переходим по символическим ссылкам:
+                    # для обычных файлов DirEntry переиспользует результат lstat,
+                    # а битые ссылки дают OSError и пропускаются
+                    st = entry.stat()
+                    found = True
+                    if st.st_nlink > 1:
+                        # Жёсткие ссылки на один файл учитываем в ключе только один раз
+                        inode = (key, st.st_dev, st.st_ino)
+                        if inode in seen_inodes:
+                            continue
+                        seen_inodes[inode] = st.st_size
+                    dir_size += st.st_size
+                except OSError:
+                    continue  # Пропускаем файлы, к которым нет доступа
+
+    # Размеры суммируются по каталогу, а не передаются наверх по одному файлу
+    if found:
+        yield key, dir_size
+
+    for entry in subdirs:
+        try:
+            fd = os.open(entry.name, _DIR_FLAGS, dir_fd=dir_fd)
+        except OSError:
+            continue  # Пропускаем недоступные каталоги
+        try:
+            if key is not None:
+                # Внутри ident ключ уже известен, путь дальше не разбираем
+                yield from _walk_sdfa(fd, parts, key, seen_inodes)
+            elif depth == 2:
+                # Интернируем имена: одинаковые project/version/ident из разных корней
+                # становятся одним объектом, и сравнение ключей сводится к сравнению ссылок
+                yield from _walk_sdfa(fd, parts, parts + (sys.intern(entry.name),), seen_inodes)
+            else:
+                yield from _walk_sdfa(fd, parts + (sys.intern(entry.name),), seen_inodes=seen_inodes)
+        finally:
+            os.close(fd)
+
+def _collect_one(root):
+    """Собирает статистику по файлам _sdfa в одном корневом каталоге"""
+    statistics = {}  # Для project/version/ident
+    root_statistics = {}  # Для корневого каталога
+    detail_statistics = {}  # Для детального распределения: key -> [размер по индексу корня]
+    linked_inodes = {}  # Файлы с жёсткими ссылками: (key, st_dev, st_ino) -> размер
+
+    # Начинаем обход сразу с SDS/data, остальные поддеревья корня не интересны.
+    # SDS и data открываем относительно корня с O_NOFOLLOW: как и os.walk(root),
+    # по символическим ссылкам на эти каталоги не переходим
+    data_fd = None
+    try:
+        root_fd = os.open(root, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            sds_fd = os.open('SDS', _DIR_FLAGS, dir_fd=root_fd)
+            try:
+                data_fd = os.open('data', _DIR_FLAGS, dir_fd=sds_fd)
+            finally:
+                os.close(sds_fd)
+        finally:
+            os.close(root_fd)
+    except OSError:
+        pass
+    if data_fd is None:
+        return statistics, root_statistics, detail_statistics, linked_inodes  # Пропускаем несуществующие каталоги
+
+    root_count = len(ROOT_DIRECTORIES)
+    root_idx = ROOT_INDEX[root]
+
+    try:
+        for key, size in _walk_sdfa(data_fd, seen_inodes=linked_inodes):
+            statistics[key] = statistics.get(key, 0) + size
+            root_statistics[root] = root_statistics.get(root, 0) + size
+            per_root = detail_statistics.get(key)
+            if per_root is None:
+                per_root = detail_statistics[key] = [0] * root_count
+            per_root[root_idx] += size
+    finally:
+        os.close(data_fd)
+
+    return statistics, root_statistics, detail_statistics, linked_inodes
+
 def collect_data():
     """Собирает статистику по файлам _sdfa во всех указанных корневых каталогах"""
-    statistics = defaultdict(int)  # Для project/version/ident
-    root_statistics = defaultdict(int)  # Для корневых каталогов
-    detail_statistics = defaultdict(lambda: defaultdict(int))  # Для детального распределения
-    
-    for root in ROOT_DIRECTORIES:
-        if not os.path.exists(root):
-            continue  # Пропускаем несуществующие каталоги
-            
-        for dirpath, dirnames, filenames in os.walk(root):
-            # Получаем относительный путь от корневого каталога
-            relative_path = os.path.relpath(dirpath, root)
-            parts = relative_path.split(os.sep)
-            
-            # Проверяем, что путь начинается с SDS/data
-            if len(parts) < 2 or parts[0] != 'SDS' or parts[1] != 'data':
-                continue
-                
-            # Проверяем наличие необходимой структуры каталогов (project/version/ident)
-            if len(parts) < 5:
-                continue
-                
-            project = parts[2]
-            version = parts[3]
-            ident = parts[4]
-            
-            # Обрабатываем файлы с суффиксом _sdfa
-            for filename in filenames:
-                if filename.endswith('_sdfa'):
-                    file_path = os.path.join(dirpath, filename)
-                    try:
-                        size = os.path.getsize(file_path)
-                        statistics[(project, version, ident)] += size
-                        root_statistics[root] += size
-                        detail_statistics[(project, version, ident)][root] += size
-                    except OSError:
-                        continue  # Пропускаем файлы, к которым нет доступа
-                        
+    statistics = {}  # Для project/version/ident
+    root_statistics = {}  # Для корневых каталогов
+    detail_statistics = {}  # Для детального распределения: key -> [размер по индексу корня]
+
+    # Корневые каталоги лежат на разных дисках, поэтому обходим их параллельно
+    with ThreadPoolExecutor(max_workers=max(len(ROOT_DIRECTORIES), 1)) as executor:
+        results = executor.map(_collect_one, ROOT_DIRECTORIES)
+
+        # Сливаем результаты в порядке ROOT_DIRECTORIES
+        merged_inodes = set()
+        for root, (root_stats, root_totals, root_details, linked_inodes) in zip(ROOT_DIRECTORIES, results):
+            # Файл, жёстко связанный с уже учтённым в предыдущем корне, повторно не считаем
+            root_idx = ROOT_INDEX[root]
+            for inode, size in linked_inodes.items():
+                if inode in merged_inodes:
+                    key = inode[0]
+                    root_stats[key] -= size
+                    root_totals[root] -= size
+                    root_details[key][root_idx] -= size
+                else:
+                    merged_inodes.add(inode)
+
+            for key, size in root_stats.items():
+                statistics[key] = statistics.get(key, 0) + size
+            for root_name, size in root_totals.items():
+                root_statistics[root_name] = root_statistics.get(root_name, 0) + size
+            for key, per_root in root_details.items():
+                merged = detail_statistics.get(key)
+                if merged is None:
+                    detail_statistics[key] = per_root
+                    continue
+                for i, size in enumerate(per_root):
+                    merged[i] += size
+
     return statistics, root_statistics, detail_statistics
 
+def _distribution(sizes, total_size):
+    """Формирует распределение по корневым каталогам из списка размеров"""
+    # Делим один раз на строку, дальше только умножаем
+    scale = (100 / total_size) if total_size > 0 else 0
+    return [{
+        'root': root,
+        'size': size,
+        'percentage': size * scale
+    } for root, size in zip(ROOT_DIRECTORIES, sizes)]
+
 def build_hierarchy(project_version_ident_data, detail_statistics):
     """Строит иерархическую структуру данных по проектам, идентификаторам и версиям"""
-    hierarchy = defaultdict(lambda: {
-        'idents': defaultdict(lambda: {
-            'versions': {},
-            'total_size': 0,
-            'distribution': []
-        }),
-        'total_size': 0,
-        'distribution': []
-    })
-
-    # Инициализируем распределение по корневым каталогам для всех проектов
-    for root in ROOT_DIRECTORIES:
-        for project in project_version_ident_data:
-            project_name = project[0]
-
-            # Инициализируем распределение по корневым каталогам для проекта
-            if len(hierarchy[project_name]['distribution']) < len(ROOT_DIRECTORIES):
-                hierarchy[project_name]['distribution'].append({
-                    'root': root,
-                    'size': 0,
-                    'percentage': 0
-                })
-
-            # Инициализируем распределение по корневым каталогам для идентификатора
-            ident_name = project[2]
-            if len(hierarchy[project_name]['idents'][ident_name]['distribution']) < len(ROOT_DIRECTORIES):
-                hierarchy[project_name]['idents'][ident_name]['distribution'].append({
-                    'root': root,
-                    'size': 0,
-                    'percentage': 0
-                })
-
-    # Заполняем данными
-    for (project, version, ident), total_size in project_version_ident_data.items():
-        # Добавляем данные о версии
-        if 'versions' not in hierarchy[project]['idents'][ident]:
-            hierarchy[project]['idents'][ident]['versions'] = {}
-
-        hierarchy[project]['idents'][ident]['versions'][version] = {
-            'total_size': total_size,
-            'distribution': []
+    root_count = len(ROOT_DIRECTORIES)
+    project_sizes = {}  # project -> [размер по индексу корня]
+    # (project, ident) -> ([размер по индексу корня], {version: (total_size, [размер по индексу корня])})
+    ident_data = {}
+
+    # Один проход: накапливаем размеры по проектам и идентификаторам.
+    # Вложенные объекты достаём одним обращением к словарю и держим в локальных переменных
+    for key, total_size in project_version_ident_data.items():
+        project, version, ident = key
+        sizes = detail_statistics[key]
+
+        project_total = project_sizes.get(project)
+        if project_total is None:
+            project_total = project_sizes[project] = [0] * root_count
+        ident_key = (project, ident)
+        ident_entry = ident_data.get(ident_key)
+        if ident_entry is None:
+            ident_entry = ident_data[ident_key] = ([0] * root_count, {})
+        ident_total, versions = ident_entry
+        versions[version] = (total_size, sizes)
+
+        for j in range(root_count):
+            size = sizes[j]
+            project_total[j] += size
+            ident_total[j] += size
+
+    # Формируем итоговую структуру, проценты считаем один раз по готовым суммам
+    hierarchy = {}
+    for (project, ident), (sizes, versions) in ident_data.items():
+        project_entry = hierarchy.get(project)
+        if project_entry is None:
+            project_total = sum(project_sizes[project])
+            project_entry = hierarchy[project] = {
+                'idents': {},
+                'total_size': project_total,
+                'distribution': _distribution(project_sizes[project], project_total)
+            }
+
+        ident_total = sum(sizes)
+        project_entry['idents'][ident] = {
+            'versions': {
+                version: {
+                    'total_size': total_size,
+                    'distribution': _distribution(version_sizes, total_size)
+                } for version, (total_size, version_sizes) in versions.items()
+            },
+            'total_size': ident_total,
+            'distribution': _distribution(sizes, ident_total)
         }
 
-        # Заполняем распределение по корневым каталогам для версии
-        for i, root in enumerate(ROOT_DIRECTORIES):
-            root_size = detail_statistics[(project, version, ident)].get(root, 0)
-            percentage = (root_size / total_size * 100) if total_size > 0 else 0
+    return hierarchy
 
-            hierarchy[project]['idents'][ident]['versions'][version]['distribution'].append({
-                'root': root,
-                'size': root_size,
-                'percentage': percentage
+def _iter_projects(hierarchy):
+    """Лениво преобразует иерархию в записи проектов для шаблона"""
+    for project_name, project_data in hierarchy.items():
+        idents = []
+        for ident_name, ident_data in project_data['idents'].items():
+            versions = [{
+                'name': version_name,
+                'total_size': version_data['total_size'],
+                'distribution': version_data['distribution']
+            } for version_name, version_data in ident_data['versions'].items()]
+
+            # Сортируем версии по размеру
+            versions.sort(key=lambda x: x['total_size'], reverse=True)
+            idents.append({
+                'name': ident_name,
+                'total_size': ident_data['total_size'],
+                'distribution': ident_data['distribution'],
+                'versions': versions
             })
 
-            # Обновляем итоги по идентификатору
-            if i < len(hierarchy[project]['idents'][ident]['distribution']):
-                hierarchy[project]['idents'][ident]['total_size'] += root_size
-                hierarchy[project]['idents'][ident]['distribution'][i]['size'] += root_size
+        yield {
+            'name': project_name,
+            'total_size': project_data['total_size'],
+            'distribution': project_data['distribution'],
+            'idents': idents
+        }
+
+def _build_view():
+    """Собирает статистику и готовит данные для шаблона без учёта сортировки"""
+    stats, root_stats, detail_stats = collect_data()
 
-            # Обновляем итоги по проекту
-            if i < len(hierarchy[project]['distribution']):
-                hierarchy[project]['total_size'] += root_size
-                hierarchy[project]['distribution'][i]['size'] += root_size
+    # Строим иерархическую структуру
+    hierarchy = build_hierarchy(stats, detail_stats)
+    projects = list(_iter_projects(hierarchy))
 
-    # Вычисляем проценты
-    for project in hierarchy:
-        total_project_size = hierarchy[project]['total_size']
+    # Вычисляем общее распределение по корневым каталогам
+    total_size = sum(root_stats.values())
+    root_distribution = []
 
-        for i, root_data in enumerate(hierarchy[project]['distribution']):
-            percentage = (root_data['size'] / total_project_size * 100) if total_project_size > 0 else 0
-            hierarchy[project]['distribution'][i]['percentage'] = percentage
+    for root, size in root_stats.items():
+        percentage = (size / total_size * 100) if total_size > 0 else 0
+        root_distribution.append({
+            'root': root,
+            'size': size,
+            'percentage': percentage
+        })
 
-        for ident in hierarchy[project]['idents']:
-            total_ident_size = hierarchy[project]['idents'][ident]['total_size']
+    return projects, root_distribution, total_size
 
-            for i, root_data in enumerate(hierarchy[project]['idents'][ident]['distribution']):
-                percentage = (root_data['size'] / total_ident_size * 100) if total_ident_size > 0 else 0
-                hierarchy[project]['idents'][ident]['distribution'][i]['percentage'] = percentage
+def get_data():
+    """Возвращает данные для шаблона из кэша, пересобирая их не чаще раза в _CACHE_TTL секунд"""
+    with _CACHE_LOCK:
+        if _CACHE['data'] is not None and time.monotonic() - _CACHE['ts'] < _CACHE_TTL:
+            return _CACHE['data']
 
-    return hierarchy
+        # Обход выполняется под блокировкой, чтобы параллельные запросы не запускали его повторно
+        _CACHE['data'] = _build_view()
+        _CACHE['ts'] = time.monotonic()
+        return _CACHE['data']
 
 @app.route('/')
 def index():
@@ -139,42 +294,8 @@ def index():
     sort_by = request.args.get('sort', 'total_size')
     order = request.args.get('order', 'desc')
     
-    stats, root_stats, detail_stats = collect_data()
-    
-    # Строим иерархическую структуру
-    hierarchy = build_hierarchy(stats, detail_stats)
-    
-    # Преобразуем иерархию в список для шаблона
-    projects = []
-    for project_name, project_data in hierarchy.items():
-        project_entry = {
-            'name': project_name,
-            'total_size': project_data['total_size'],
-            'distribution': project_data['distribution'],
-            'idents': []
-        }
-        
-        for ident_name, ident_data in project_data['idents'].items():
-            ident_entry = {
-                'name': ident_name,
-                'total_size': ident_data['total_size'],
-                'distribution': ident_data['distribution'],
-                'versions': []
-            }
-            
-            for version_name, version_data in ident_data['versions'].items():
-                version_entry = {
-                    'name': version_name,
-                    'total_size': version_data['total_size'],
-                    'distribution': version_data['distribution']
-                }
-                ident_entry['versions'].append(version_entry)
-            
-            # Сортируем версии по размеру
-            ident_entry['versions'].sort(key=lambda x: x['total_size'], reverse=True)
-            project_entry['idents'].append(ident_entry)
-        
-        projects.append(project_entry)
+    # Обход и иерархия берутся из кэша, на каждый запрос выполняется только сортировка
+    projects, root_distribution, total_size = get_data()
     
     # Сортируем проекты
     def sort_key(item):
@@ -183,21 +304,10 @@ def index():
         return item['total_size']
     
     reverse = (order == 'desc')
-    projects.sort(key=lambda x: sort_key(x), reverse=reverse)
+    projects = sorted(projects, key=sort_key, reverse=reverse)
     
-    # Вычисляем общее распределение по корневым каталогам
-    total_size = sum(root_stats.values())
-    root_distribution = []
-    
-    for root, size in root_stats.items():
-        percentage = (size / total_size * 100) if total_size > 0 else 0
-        root_distribution.append({
-            'root': root,
-            'size': size,
-            'percentage': percentage
-        })
-    
-    return render_template('index.html', 
+    # Отдаём страницу по частям, не собирая весь HTML в памяти
+    return stream_template('index.html', 
                           projects=projects,  # Теперь это список, а не словарь
                           root_distribution=root_distribution,
                           total_size=total_size,
@@ -205,19 +315,24 @@ def index():
                           current_sort=sort_by,
                           current_order=order)
 
+# Единицы измерения, i-я соответствует делителю 1024 ** i
+_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB')
+
 def human_readable_size(size_bytes):
     """Преобразует байты в человекочитаемый формат"""
-    if size_bytes == 0:
+    if size_bytes <= 0:
         return "0 B"
-    
-    units = ['B', 'KB', 'MB', 'GB', 'TB', 'PB', 'EB', 'ZB', 'YB']
-    i = int(math.floor(math.log(size_bytes, 1024)))
-    p = math.pow(1024, i)
-    s = round(size_bytes / p, 2)
-    return f"{s} {units[i]}"
-
-# Регистрируем функцию для использования в шаблонах
-app.jinja_env.globals.update(human_readable_size=human_readable_size)
+
+    # Целочисленный log1024: номер старшего бита, делённый на 10
+    i = min((size_bytes.bit_length() - 1) // 10, len(_UNITS) - 1)
+    s = round(size_bytes / (1 << (10 * i)), 2)
+    return f"{s} {_UNITS[i]}"
+
+# Регистрируем функцию как фильтр шаблонов: {{ size|hsize }}
+app.jinja_env.filters['hsize'] = human_readable_size
+
+# Компилируем шаблон заранее, чтобы первый запрос не тратил время на разбор
+app.jinja_env.get_template('index.html')
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)